@@ -7,22 +7,41 @@ Usage:
 """
 
 import argparse
+import concurrent.futures
+import os
 import sys
 from pathlib import Path
 
 try:
-    from datafusion import SessionContext
+    from datafusion import SessionConfig, SessionContext
 except ImportError:
     print("Error: datafusion is required. Install with: uv pip install datafusion")
     sys.exit(1)
 
 try:
-    import pyarrow.parquet as pq
     import pyarrow as pa
+    import pyarrow.parquet as pq
 except ImportError:
     print("Error: pyarrow is required. Install with: uv pip install pyarrow")
     sys.exit(1)
 
+# Explicit Parquet layout knobs rather than library defaults: ~128Ki-row row
+# groups with statistics let downstream scans prune and parallelize well, and
+# zstd is ~30% smaller than the default snappy at comparable decode cost
+ROW_GROUP_SIZE = 131072
+
+# Queries executed concurrently; kept small so each query still gets several
+# cores from DataFusion's internal thread pool
+QUERY_WORKERS = 4
+PARQUET_WRITER_OPTIONS = dict(
+    compression='zstd',
+    compression_level=3,
+    use_dictionary=True,
+    write_statistics=True,
+    # Page index enables page-level predicate pushdown in readers
+    write_page_index=True,
+)
+
 
 def register_parquet_tables(ctx, data_dir: Path):
     """Register all Parquet files in the data directory as tables."""
@@ -39,6 +58,9 @@ def register_parquet_tables(ctx, data_dir: Path):
         
         # Register the Parquet file as a table
         ctx.register_parquet(f'"{table_name}"', str(parquet_file))
+        # Warm the footer/statistics cache with a zero-row scan so the
+        # metadata is parsed once here rather than once per query
+        ctx.sql(f'SELECT * FROM "{table_name}" LIMIT 0').collect()
         registered_tables.append(table_name)
         print(f"Registered table '{table_name}' from {parquet_file.name}")
     
@@ -46,35 +68,70 @@ def register_parquet_tables(ctx, data_dir: Path):
 
 
 def execute_query(ctx, sql: str, output_path: Path) -> None:
-    """Execute a SQL query and write the result to a Parquet file."""
+    """Execute a SQL query and stream the result to a Parquet file.
+
+    Batches go straight from the DataFusion stream into the Parquet writer,
+    so peak memory is one batch rather than the whole result set plus a
+    concatenated copy.
+    """
     print(f"Executing query and writing result to {output_path.name}...")
-    
+
     try:
         # Execute the query
         df = ctx.sql(sql)
-        
-        # Collect results
-        batches = df.collect()
-        
-        # Write to Parquet
+
         output_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Convert batches to PyArrow table and write to Parquet
-        if batches:
-            # Combine all batches into a single table
-            table = pa.Table.from_batches(batches)
+
+        if hasattr(df, 'execute_stream'):
+            batches = (batch.to_pyarrow() for batch in df.execute_stream())
         else:
-            # Empty result - create empty table
-            # We'll create a minimal empty table (this is a fallback)
-            # In practice, most queries should return at least one row
-            table = pa.Table.from_pylist([])
-        
-        pq.write_table(table, output_path)
-        
-        # Get row count for confirmation
-        row_count = table.num_rows
+            # Older bindings without a streaming API: collect, but still
+            # write batch-by-batch without concatenating into one table
+            batches = iter(df.collect())
+
+        # Write to a .tmp sibling and rename only after verification, so a
+        # query that fails mid-stream cannot leave a truncated file at the
+        # real result name (closing the writer still finalizes the footer)
+        tmp_path = output_path.with_name(output_path.name + '.tmp')
+
+        # Buffer small batches up to ROW_GROUP_SIZE rows so each flush becomes
+        # one well-sized row group instead of one tiny row group per batch
+        row_count = 0
+        schema = df.schema()
+        buffered = []
+        buffered_rows = 0
+        with pq.ParquetWriter(tmp_path, schema, **PARQUET_WRITER_OPTIONS) as writer:
+            def _flush():
+                writer.write_table(
+                    pa.Table.from_batches(buffered, schema),
+                    row_group_size=ROW_GROUP_SIZE,
+                )
+                buffered.clear()
+
+            for batch in batches:
+                buffered.append(batch)
+                buffered_rows += batch.num_rows
+                row_count += batch.num_rows
+                if buffered_rows >= ROW_GROUP_SIZE:
+                    _flush()
+                    buffered_rows = 0
+            if buffered:
+                _flush()
+
+        # Verify the written file from its footer; memory_map + pre_buffer
+        # keep this a metadata-only read instead of decoding the whole file
+        written_rows = pq.ParquetFile(
+            tmp_path, memory_map=True, pre_buffer=True
+        ).metadata.num_rows
+        if written_rows != row_count:
+            raise RuntimeError(
+                f"Wrote {written_rows} rows to {tmp_path.name}, "
+                f"expected {row_count}"
+            )
+        tmp_path.rename(output_path)
+
         print(f"  ✓ Query executed successfully. Result has {row_count} rows.")
-        
+
     except Exception as e:
         print(f"  ✗ Error executing query: {e}")
         raise
@@ -122,9 +179,22 @@ def main():
     # Create output directory
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    # Create DataFusion context
+    # Create DataFusion context with all cores enabled; the defaults can
+    # leave partitions (and therefore cores) idle
     print("Initializing DataFusion context...")
-    ctx = SessionContext()
+    config = (
+        SessionConfig()
+        .with_target_partitions(os.cpu_count() or 4)
+        .with_batch_size(8192)
+        .with_repartition_joins(True)
+        .with_repartition_aggregations(True)
+        .with_parquet_pruning(True)
+        # Pull the footer in one sized read and keep table statistics around
+        # so each query plans without re-reading Parquet metadata
+        .set('datafusion.execution.parquet.metadata_size_hint', '1048576')
+        .set('datafusion.execution.collect_statistics', 'true')
+    )
+    ctx = SessionContext(config)
     
     # Register all Parquet files as tables
     print(f"\nRegistering Parquet files from {data_dir}...")
@@ -140,36 +210,40 @@ def main():
     
     print(f"Found {len(sql_files)} SQL query files\n")
     
-    # Execute each query
+    # Execute queries concurrently; they are independent and the Python
+    # SessionContext is safe for concurrent ctx.sql() calls
     successful = 0
     failed = 0
-    
-    for sql_file in sql_files:
-        print(f"Processing {sql_file.name}...")
-        
-        # Read SQL query
-        try:
-            sql = sql_file.read_text()
-        except Exception as e:
-            print(f"  ✗ Error reading SQL file: {e}")
-            failed += 1
-            continue
-        
-        # Output filename is the SQL filename with .parquet extension
-        output_filename = sql_file.stem + ".parquet"
-        output_path = output_dir / output_filename
-        
-        # Execute query and write result
-        try:
-            execute_query(ctx, sql, output_path)
-            successful += 1
-        except Exception as e:
-            print(f"  ✗ Failed to execute query: {e}")
-            import traceback
-            traceback.print_exc()
-            failed += 1
-        
-        print()  # Empty line between queries
+    futures = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=QUERY_WORKERS) as executor:
+        for sql_file in sql_files:
+            print(f"Processing {sql_file.name}...")
+
+            # Read SQL query
+            try:
+                sql = sql_file.read_text()
+            except Exception as e:
+                print(f"  ✗ Error reading SQL file: {e}")
+                failed += 1
+                continue
+
+            # Output filename is the SQL filename with .parquet extension
+            output_filename = sql_file.stem + ".parquet"
+            output_path = output_dir / output_filename
+
+            futures[executor.submit(execute_query, ctx, sql, output_path)] = sql_file
+
+        for future in concurrent.futures.as_completed(futures):
+            sql_file = futures[future]
+            try:
+                future.result()
+                successful += 1
+            except Exception as e:
+                print(f"  ✗ Failed to execute query {sql_file.name}: {e}")
+                import traceback
+                traceback.print_exc()
+                failed += 1
     
     # Summary
     print("=" * 60)
@@ -3,49 +3,131 @@
 Download and convert JSONBench dataset to Parquet format.
 
 Usage:
-    uv run --with requests python json_bench/setup.py --size <size>
+    uv run --with aiohttp --with isal python json_bench/setup.py --size <size>
 """
 
 import argparse
+import asyncio
+import concurrent.futures
 import gzip
+import os
 import shutil
 import subprocess
 import sys
+import threading
+import zlib
 from pathlib import Path
 
 try:
-    import requests
+    import aiohttp
 except ImportError:
-    print("Error: requests is required. Install with: uv pip install requests")
+    print("Error: aiohttp is required. Install with: uv pip install aiohttp")
     sys.exit(1)
 
+# Intel ISA-L (SIMD-accelerated inflate) is ~3-5x faster than stdlib gzip on
+# the decompress loop; fall back to stdlib if it is not installed
+try:
+    from isal import igzip_threaded, isal_zlib
+    _HAS_ISAL = True
+except ImportError:
+    _HAS_ISAL = False
+
+# pigz decompresses a single file with all cores and avoids the
+# Python<->C boundary per buffer; prefer it for on-disk .gz files
+_PIGZ = shutil.which('pigz')
+
+# Download/decompress concurrency. Downloads are network-bound so we keep many
+# requests in flight over pooled connections; decompression is CPU-bound so
+# one worker per core.
+DOWNLOAD_CONCURRENCY = 32
+DECOMPRESS_WORKERS = os.cpu_count() or 4
 
-def download_file(url: str, output_path: Path, chunk_size: int = 8192) -> None:
-    """Download a file from URL with progress indication."""
-    print(f"Downloading {url}...")
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
-    
-    total_size = int(response.headers.get('content-length', 0))
-    downloaded = 0
-    
-    with open(output_path, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=chunk_size):
-            if chunk:
-                f.write(chunk)
-                downloaded += len(chunk)
-                if total_size > 0:
-                    percent = (downloaded / total_size) * 100
-                    print(f"\rProgress: {percent:.1f}%", end='', flush=True)
-    print()  # New line after progress
+
+class _ProgressCounter:
+    """Thread-safe completed-file counter for parallel download/decompress."""
+
+    def __init__(self, total: int, label: str):
+        self.total = total
+        self.label = label
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def advance(self, name: str) -> None:
+        with self.lock:
+            self.count += 1
+            print(f"  [{self.count}/{self.total}] {self.label} {name}")
+
+
+async def download_and_decompress(
+    session: aiohttp.ClientSession, url: str, json_path: Path,
+    chunk_size: int = 1 << 20,
+) -> None:
+    """Download a .json.gz URL and stream-gunzip it straight to json_path.
+
+    Fusing the two stages avoids materializing the .gz file on disk, halving
+    the bytes written and read for each file.
+    """
+    tmp_path = json_path.with_name(json_path.name + '.tmp')
+    # wbits=16+MAX_WBITS tells zlib to expect a gzip header
+    zlib_mod = isal_zlib if _HAS_ISAL else zlib
+    decompressor = zlib_mod.decompressobj(16 + zlib.MAX_WBITS)
+    async with session.get(url) as response:
+        response.raise_for_status()
+        with open(tmp_path, 'wb') as f:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                # A .gz file may hold several concatenated gzip members
+                # (RFC 1952); start a fresh decompressor for each one so
+                # nothing after the first member is dropped
+                while chunk:
+                    if decompressor.eof:
+                        decompressor = zlib_mod.decompressobj(16 + zlib.MAX_WBITS)
+                    f.write(decompressor.decompress(chunk))
+                    chunk = decompressor.unused_data
+            f.write(decompressor.flush())
+    # Only bless the output once the last member inflated to completion;
+    # eof is false if the stream was truncated mid-member
+    if not decompressor.eof:
+        raise ValueError(f"Truncated gzip stream from {url}")
+    tmp_path.rename(json_path)
+
+
+def remove_tree_async(path: Path) -> threading.Thread | None:
+    """Delete a directory tree off the critical path.
+
+    The directory is renamed out of the way first (near-instant on the same
+    filesystem), then unlinked in a background thread; callers join the
+    returned thread at the very end of the run.
+    """
+    if not path.exists():
+        return None
+    trash = path.with_name(path.name + '.trash')
+    try:
+        path.rename(trash)
+    except OSError:
+        trash = path  # Rename failed (e.g. leftover trash dir); delete in place
+    thread = threading.Thread(
+        target=shutil.rmtree, args=(trash,), kwargs={'ignore_errors': True}
+    )
+    thread.start()
+    return thread
 
 
 def decompress_gz_file(gz_path: Path, output_path: Path) -> None:
     """Decompress a .gz file."""
-    print(f"Decompressing {gz_path.name}...")
-    with gzip.open(gz_path, 'rb') as f_in:
+    if _PIGZ:
+        # -k keeps the .gz so the caller's keep-json logic stays in charge
+        subprocess.run([_PIGZ, '-d', '-k', '-f', str(gz_path)], check=True)
+        produced = gz_path.with_suffix('')  # pigz writes the sibling .json
+        if produced != output_path:
+            produced.rename(output_path)
+        return
+    if _HAS_ISAL:
+        f_in = igzip_threaded.open(gz_path, 'rb', threads=4)
+    else:
+        f_in = gzip.open(gz_path, 'rb')
+    with f_in:
         with open(output_path, 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
+            shutil.copyfileobj(f_in, f_out, length=1 << 20)
 
 
 def get_jsonbench_urls(size: str) -> tuple:
@@ -150,11 +232,9 @@ def main():
     else:
         output_dir = script_dir / args.output_dir
     
-    download_dir = script_dir / 'downloads'
     json_dir = script_dir / f'json-{size}'
     tool_dir = script_dir / 'json_to_variant'
-    
-    download_dir.mkdir(exist_ok=True)
+
     json_dir.mkdir(exist_ok=True)
     output_dir.mkdir(parents=True, exist_ok=True)
     
@@ -172,67 +252,99 @@ def main():
     
     print(f"Dataset size: {description} ({len(urls)} files)")
     
-    # Step 1: Download JSON files (unless skipped)
+    # Step 1: Download and decompress JSON files (pipelined)
+    # Downloads run as asyncio tasks over a shared aiohttp session and are
+    # stream-gunzipped as the bytes arrive; the thread pool only decompresses
+    # .gz files already on disk (leftovers and --skip-download), overlapping
+    # with the remaining downloads.
+    json_files = []
+    decompress_futures = []
+    decompress_pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=DECOMPRESS_WORKERS
+    )
+
+    def _decompress_one(gz_path: Path, progress: _ProgressCounter) -> Path:
+        output_json = json_dir / gz_path.stem  # Remove .gz extension to get .json
+        if not output_json.exists():
+            decompress_gz_file(gz_path, output_json)
+            # Remove .gz file after successful decompression (unless --keep-json is set)
+            # Actually, --keep-json means keep JSON, so we remove .gz to save space
+            if not args.keep_json:
+                gz_path.unlink()
+        progress.advance(gz_path.name)
+        return output_json
+
     if not args.skip_download:
-        print(f"\nStep 1: Downloading {len(urls)} JSON files (compressed as .gz)...")
-        downloaded_files = []
-        for url, filename in urls:
-            download_path = download_dir / filename
-            gz_path = json_dir / filename  # Files are downloaded as .gz
-            
-            # Skip if already downloaded
+        print(f"\nStep 1: Downloading and decompressing {len(urls)} JSON files...")
+        progress = _ProgressCounter(len(urls), "Fetched")
+        semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+
+        async def _download_one(
+            session: aiohttp.ClientSession, url: str, filename: str
+        ) -> None:
+            gz_path = json_dir / filename
+            output_json = json_dir / Path(filename).stem
+
             if gz_path.exists():
-                print(f"  Skipping {filename} (already exists)")
-                downloaded_files.append(gz_path)
-                continue
-            
-            # Download
-            try:
-                download_file(url, download_path)
-                # Move to json_dir
-                download_path.rename(gz_path)
-                downloaded_files.append(gz_path)
-            except Exception as e:
-                print(f"  Error downloading {filename}: {e}")
-                # Try to continue with other files
-                continue
-        
-        print(f"Downloaded {len(downloaded_files)} files")
+                # Compressed file left over from an earlier run; gunzip it
+                # off the event loop instead of re-downloading
+                decompress_futures.append(
+                    decompress_pool.submit(_decompress_one, gz_path, progress)
+                )
+                return
+            # Skip if already decompressed
+            if not output_json.exists():
+                async with semaphore:
+                    await download_and_decompress(session, url, output_json)
+            progress.advance(filename)
+
+        async def _download_all() -> None:
+            # One session for all files so TCP connections and TLS contexts
+            # are pooled instead of re-negotiated per URL
+            connector = aiohttp.TCPConnector(
+                limit=DOWNLOAD_CONCURRENCY, keepalive_timeout=60
+            )
+            # No total deadline: multi-hundred-MB files sharing bandwidth can
+            # legitimately exceed aiohttp's 5-minute default; a stalled socket
+            # still fails via sock_read
+            timeout = aiohttp.ClientTimeout(total=None, sock_read=60)
+            async with aiohttp.ClientSession(
+                connector=connector, timeout=timeout
+            ) as session:
+                results = await asyncio.gather(
+                    *[_download_one(session, url, filename) for url, filename in urls],
+                    return_exceptions=True,
+                )
+            for (url, filename), result in zip(urls, results):
+                if isinstance(result, Exception):
+                    # Try to continue with other files
+                    print(f"  Error downloading {filename}: {result}")
+
+        asyncio.run(_download_all())
     else:
-        print(f"\nStep 1: Skipping download (using existing files)")
-    
-    # Step 2: Decompress .gz files
-    print(f"\nStep 2: Decompressing .gz files...")
-    json_files = []
-    
-    # Find all .gz files that need decompression
-    gz_files = sorted(json_dir.glob("*.json.gz"))
-    decompressed_count = 0
-    
-    for gz_path in gz_files:
-        output_json = json_dir / gz_path.stem  # Remove .gz extension to get .json
-        if output_json.exists():
-            print(f"  Skipping {gz_path.name} (already decompressed)")
-            json_files.append(output_json)
-        else:
-            try:
-                decompress_gz_file(gz_path, output_json)
-                json_files.append(output_json)
-                decompressed_count += 1
-                # Remove .gz file after successful decompression (unless --keep-json is set)
-                # Actually, --keep-json means keep JSON, so we remove .gz to save space
-                if not args.keep_json:
-                    gz_path.unlink()
-            except Exception as e:
-                print(f"  Error decompressing {gz_path.name}: {e}")
-                continue
-    
+        print(f"\nStep 1: Skipping download (decompressing existing files)")
+        gz_files = sorted(json_dir.glob("*.json.gz"))
+        decompress_progress = _ProgressCounter(len(gz_files), "Decompressed")
+        for gz_path in gz_files:
+            decompress_futures.append(
+                decompress_pool.submit(_decompress_one, gz_path, decompress_progress)
+            )
+
+    # Wait for all decompress tasks and collect results
+    for future in concurrent.futures.as_completed(decompress_futures):
+        try:
+            json_files.append(future.result())
+        except Exception as e:
+            print(f"  Error decompressing: {e}")
+            continue
+    decompress_pool.shutdown()
+
     # Also check for any existing .json files (not from .gz)
     for json_path in json_dir.glob("*.json"):
         if json_path not in json_files and not json_path.name.endswith('.json.gz'):
             json_files.append(json_path)
-    
-    print(f"Decompressed {decompressed_count} files, found {len(json_files)} JSON files total")
+
+    print(f"Found {len(json_files)} JSON files total")
     
     if not json_files:
         print("Error: No JSON files found after download/decompression")
@@ -240,16 +352,16 @@ def main():
     
     print(f"Found {len(json_files)} JSON files ready for conversion")
     
-    # Step 3: Build json_to_variant tool
-    print(f"\nStep 3: Building json_to_variant conversion tool...")
+    # Step 2: Build json_to_variant tool
+    print(f"\nStep 2: Building json_to_variant conversion tool...")
     try:
         tool_binary = build_json_to_variant_tool(tool_dir)
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
     
-    # Step 4: Convert JSON to Parquet
-    print(f"\nStep 4: Converting JSON files to Parquet...")
+    # Step 3: Convert JSON to Parquet
+    print(f"\nStep 3: Converting JSON files to Parquet...")
     output_parquet = output_dir / 'bluesky.parquet'
     
     try:
@@ -284,28 +396,27 @@ def main():
         traceback.print_exc()
         sys.exit(1)
     
-    # Step 5: Cleanup
-    print(f"\nStep 5: Cleaning up...")
-    
-    # Remove download directory
-    if download_dir.exists():
-        print(f"Removing download directory: {download_dir}")
-        shutil.rmtree(download_dir)
+    # Step 4: Cleanup
+    print(f"\nStep 4: Cleaning up...")
     
     # Remove JSON files unless --keep-json is specified
+    cleanup_thread = None
     if not args.keep_json:
         if json_dir.exists():
-            print(f"Removing JSON directory: {json_dir}")
-            shutil.rmtree(json_dir)
+            print(f"Removing JSON directory in the background: {json_dir}")
+            cleanup_thread = remove_tree_async(json_dir)
     else:
         print(f"Keeping JSON files in: {json_dir}")
-    
+
     print("\n" + "=" * 60)
     print(f"Setup complete!")
     print(f"  Dataset size: {description}")
     print(f"  Parquet file: {output_parquet}")
     print(f"  Output directory: {output_dir}")
 
+    if cleanup_thread is not None:
+        cleanup_thread.join()
+
 
 if __name__ == '__main__':
     main()